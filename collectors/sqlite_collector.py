@@ -16,14 +16,27 @@ class SqliteCollector:
     {"query", "explain", "logs", "schema", "stats", "config", "system"}
     """
 
-    def __init__(self, db_path: str) -> None:
+    def __init__(self, db_path: str, persistent: bool = False) -> None:
         self.db_path = db_path
+        self.persistent = persistent
+        self._conn: Optional[sqlite3.Connection] = None
 
     def _connect(self) -> sqlite3.Connection:
-        conn = sqlite3.connect(self.db_path)
+        if self.persistent and self._conn is not None:
+            return self._conn
+        # A persistent connection may be reused from another thread (e.g. a later Streamlit rerun)
+        conn = sqlite3.connect(self.db_path, check_same_thread=not self.persistent)
         conn.row_factory = sqlite3.Row  # Enable column access by name
+        if self.persistent:
+            self._conn = conn
         return conn
 
+    def close(self) -> None:
+        """Close the persistent connection, if one is open."""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
     def test_connection(self) -> bool:
         try:
             with self._connect() as conn:
@@ -6,7 +6,7 @@ Handles API communication and XML-based structured prompting.
 import google.generativeai as genai
 import os
 import re
-from typing import Dict, Optional
+from typing import Dict, Iterator, Mapping, Optional
 from dotenv import load_dotenv
 from xml_utils import (
     create_input_xml,
@@ -15,6 +15,7 @@ from xml_utils import (
     create_chat_system_prompt,
     build_chat_prompt,
     extract_response_from_text,
+    extract_response_from_stream,
 )
 
 # Load environment variables from .env file
@@ -112,7 +113,7 @@ class DatabaseDiagnostician:
                 "raw_response": ""
             }
 
-    def improve_query(self, db_data: Dict[str, str], prior_diagnosis_xml: Optional[str] = None, prior_diagnosis: Optional[Dict[str, any]] = None, improvement_context: Optional[str] = None) -> Dict[str, str]:
+    def improve_query(self, db_data: Mapping[str, str], prior_diagnosis_xml: Optional[str] = None, prior_diagnosis: Optional[Dict[str, any]] = None, improvement_context: Optional[str] = None) -> Dict[str, str]:
         """
         Ask the LLM to propose an improved SQL query given the same inputs.
         Enhanced version supports recursive improvements with comprehensive context.
@@ -305,6 +306,21 @@ class DatabaseDiagnostician:
         raw = response.text or ""
         return extract_response_from_text(raw)
 
+    def chat_respond_stream(self, history: list, user_message: str) -> Iterator[str]:
+        """
+        Streaming variant of chat_respond.
+
+        Args:
+            history: List of dicts with optional keys 'user' and 'response'
+            user_message: The latest user message
+
+        Yields:
+            Chunks of the cleaned response content as they arrive from the model
+        """
+        prompt = build_chat_prompt(history=history, user_message=user_message)
+        response = self.simple_chat.send_message(prompt, stream=True)
+        yield from extract_response_from_stream(chunk.text for chunk in response)
+
 
 def test_connection() -> bool:
     """
@@ -0,0 +1,198 @@
+"""
+Rule-based diagnosis for trivially bad SQLite plans.
+Recognizes a missing-index full scan directly from the query plan so the
+LLM round-trip can be skipped; anything less clear-cut is left to the AI.
+"""
+
+import re
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+
+_PLAN_ACCESS_RE = re.compile(r"^(?:SCAN|SEARCH)\b")
+_PLAN_FULL_SCAN_RE = re.compile(r"^SCAN (?:TABLE )?(\w+)$")
+_PLAN_TEMP_BTREE_RE = re.compile(r"^USE TEMP B-TREE FOR (.+)$")
+_SQL_STRING_LITERAL_RE = re.compile(r"'(?:[^']|'')*'")
+_FROM_CLAUSE_RE = re.compile(r"\bFROM\b(.*?)\bWHERE\b", re.IGNORECASE | re.DOTALL)
+_WHERE_CLAUSE_RE = re.compile(
+    r"\bWHERE\b(.*?)(?:\bGROUP\s+BY\b|\bORDER\s+BY\b|\bHAVING\b|\bLIMIT\b|;|$)",
+    re.IGNORECASE | re.DOTALL,
+)
+_IDENTIFIER_RE = re.compile(r"^[A-Za-z_]\w*$")
+
+# One indexable predicate: [qualifier.]column compared against literals/parameters only.
+# Anything else (OR, NOT, !=, <>, LIKE, functions, column-to-column, subqueries) fails to match.
+_VALUE = r"(?:''|[+-]?\d+(?:\.\d+)?|\?\d*|[:@$]\w+)"
+_PREDICATE_RE = re.compile(
+    r"\s*(?:(\w+)\.)?(\w+)\s*(?:"
+    rf"(?P<eq>==?)\s*{_VALUE}"
+    rf"|(?P<in>IN)\s*\(\s*{_VALUE}(?:\s*,\s*{_VALUE})*\s*\)"
+    rf"|(?P<range><=|>=|<|>)\s*{_VALUE}"
+    rf"|(?P<between>BETWEEN)\s+{_VALUE}\s+AND\s+{_VALUE}"
+    r")\s*",
+    re.IGNORECASE,
+)
+_AND_RE = re.compile(r"AND\b", re.IGNORECASE)
+
+
+def _resolve_scanned_table(query: str, scanned: str) -> Optional[Tuple[str, List[str]]]:
+    """
+    Map the plan's scanned name (table or alias) to the real table of a single-table FROM.
+
+    Returns the table and the names a column may be qualified with, or None when
+    the FROM clause is not a plain single table the scan can be tied to.
+    """
+    match = _FROM_CLAUSE_RE.search(query)
+    if not match:
+        return None
+    tokens = match.group(1).split()
+    if len(tokens) == 3 and tokens[1].upper() == "AS":
+        tokens = [tokens[0], tokens[2]]
+    if not 1 <= len(tokens) <= 2 or not all(_IDENTIFIER_RE.match(t) for t in tokens):
+        return None
+
+    table = tokens[0]
+    names = [n.lower() for n in tokens]
+    if scanned.lower() != names[-1]:
+        # SQLite reports the alias when there is one, otherwise the table name
+        return None
+    return table, names
+
+
+def _where_index_columns(where: str, qualifiers: List[str]) -> Optional[List[str]]:
+    """
+    Index columns for an AND-only chain of =, IN and range predicates, or None.
+
+    Equality columns come first, followed by the first range column, since an
+    index cannot be used for any column after a range-constrained one.
+    """
+    equality: List[str] = []
+    ranged: List[str] = []
+    pos, end = 0, len(where)
+    while True:
+        match = _PREDICATE_RE.match(where, pos)
+        if not match:
+            return None
+        qualifier, column = match.group(1), match.group(2)
+        if qualifier and qualifier.lower() not in qualifiers:
+            return None
+        target = equality if match.group("eq") or match.group("in") else ranged
+        if column not in equality and column not in ranged:
+            target.append(column)
+        pos = match.end()
+        if pos == end:
+            break
+        conjunction = _AND_RE.match(where, pos)
+        if not conjunction:
+            return None
+        pos = conjunction.end()
+    return equality + [c for c in ranged[:1] if c not in equality]
+
+
+def _schema_table_info(schema: str, table: str) -> Optional[Tuple[List[str], List[str]]]:
+    """Column and index names listed for ``table`` in the collector's schema text."""
+    columns: List[str] = []
+    indexes: List[str] = []
+    section = None
+    found = False
+    for line in schema.splitlines():
+        if not line.startswith(" "):
+            header = line.strip().lower()
+            if header == f"table: {table.lower()}":
+                section, found = columns, True
+            elif header == f"indexes for {table.lower()}:":
+                section = indexes
+            else:
+                section = None
+        elif section is not None and line.strip():
+            section.append(line.split()[0].lower())
+    return (columns, indexes) if found else None
+
+
+def try_rule_based(db_data: Mapping[str, str]) -> Optional[Dict[str, Any]]:
+    """
+    Diagnose trivially bad SQLite plans without calling the LLM.
+
+    Only fires when the plan fully scans the single table of the FROM clause,
+    the WHERE clause is an AND-only chain of =, IN and range predicates on that
+    table, the schema lists those columns, and none of its indexes mention them.
+    Returns None for anything else so the caller falls back to the AI analysis.
+    """
+    details = [
+        line.rsplit("|", 1)[-1].strip()
+        for line in (db_data.get("explain") or "").splitlines()
+        if line.strip()
+    ]
+    access = [d for d in details if _PLAN_ACCESS_RE.match(d)]
+    if len(access) != 1:
+        return None
+
+    scan = _PLAN_FULL_SCAN_RE.match(access[0])
+    query = _SQL_STRING_LITERAL_RE.sub("''", db_data.get("query") or "")
+    where = _WHERE_CLAUSE_RE.search(query)
+    if not scan or not where:
+        return None
+
+    resolved = _resolve_scanned_table(query, scan.group(1))
+    if resolved is None:
+        return None
+    table, qualifiers = resolved
+
+    columns = _where_index_columns(where.group(1), qualifiers)
+    if not columns:
+        return None
+
+    # The missing index is only asserted when the schema shows the table and its indexes
+    table_info = _schema_table_info(db_data.get("schema") or "", table)
+    if table_info is None:
+        return None
+    known_columns, index_names = table_info
+    lowered = [c.lower() for c in columns]
+    if any(c not in known_columns for c in lowered):
+        return None
+    # The schema lists index names only; treat a name containing the column as a name part as covering it
+    if any(f"_{c}_" in f"_{name}_" for name in index_names for c in lowered):
+        return None
+
+    column_list = ", ".join(columns)
+    bottlenecks = [{
+        "type": "IndexBottleneck",
+        "severity": "High",
+        "description": f"Full table scan on {table}: every row is read to evaluate the filter on {column_list}.",
+    }]
+    for d in details:
+        temp = _PLAN_TEMP_BTREE_RE.match(d)
+        if temp:
+            bottlenecks.append({
+                "type": "SortBottleneck",
+                "severity": "Medium",
+                "description": f"Temporary B-tree built for {temp.group(1)} after the scan.",
+            })
+
+    return {
+        "reasoning": (
+            f"The query reads `{table}` and filters it on {column_list}, but the query plan shows a full "
+            f"scan of `{table}` with no index supporting the WHERE clause. Every row has to be read and "
+            "tested, so the cost grows linearly with the table size.\n\n"
+            "This pattern was recognised directly from the query plan, so no AI analysis was needed."
+        ),
+        "bottlenecks": bottlenecks,
+        "root_causes": [
+            {
+                "type": "MissingIndex",
+                "description": f"None of the indexes listed for {table} in the schema cover {column_list}.",
+            },
+            {"type": "FullTableScan", "description": f"SQLite falls back to scanning all of {table}."},
+        ],
+        "recommendations": [
+            {
+                "type": "CreateIndex",
+                "priority": "High",
+                "description": f"CREATE INDEX idx_{table}_{'_'.join(columns)} ON {table}({column_list});",
+            },
+            {"type": "UpdateStatistics", "priority": "Low", "description": "ANALYZE;"},
+        ],
+        "comments": ["Re-run the query plan after creating the index to confirm a SEARCH replaces the SCAN."],
+        "rule_based": True,
+        "raw_input": db_data,
+        "raw_response": "",
+    }
@@ -5,17 +5,28 @@ Clean, minimal Swiss design for visualizing database performance analysis.
 
 import streamlit as st
 import os
+import time
+from array import array
+from collections import ChainMap
+from functools import lru_cache
 from datetime import datetime
 from fake_db_data import SAMPLE_DATA
-from gemini_client import DatabaseDiagnostician, test_connection
 from xml_utils import format_diagnosis_output, clean_response_from_xml_tags
+from rule_based import try_rule_based
+from dotenv import load_dotenv
 import json
 import re
-from collectors.sqlserver_collector import SqlServerCollector
-from collectors.sqlite_collector import SqliteCollector
-import plotly.graph_objects as go
-import plotly.express as px
-from typing import List, Dict, Any
+from typing import TYPE_CHECKING, List, Dict, Any, Optional
+
+if TYPE_CHECKING:
+    # Annotation-only; the real imports stay lazy inside the functions that use them
+    import plotly.graph_objects as go
+    from collectors.sqlite_collector import SqliteCollector
+    from collectors.sqlserver_collector import SqlServerCollector
+
+# gemini_client (and the google SDK behind it) is imported only where a model call is made;
+# load .env here so the API-key check in main() sees it on a cold start
+load_dotenv()
 
 
 # Swiss Design Configuration
@@ -26,8 +37,30 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
+# Scenario keys never change at runtime; build the selectbox options once
+_SCENARIO_KEYS = tuple(SAMPLE_DATA.keys())
+# Stripped preview fields per scenario, built once instead of on every rerun
+_SCENARIO_PREVIEWS = {
+    key: {
+        "query": data["query"].strip(),
+        "explain": data["explain"].strip(),
+        "schema": data["schema"].strip(),
+    }
+    for key, data in SAMPLE_DATA.items()
+}
+_SCENARIO_NAMES = {
+    "slow_select_without_index": "Slow SELECT Query (Missing Index)",
+    "inefficient_join": "Inefficient JOIN Operation"
+}
+_SEVERITY_ICON = {"High": "🔴", "Medium": "🟠", "Low": "🟡"}
+_PRIORITY_ICON = {"High": "🔥", "Medium": "⚡", "Low": "💡"}
+# Marker colour per iteration type on the progress chart
+_TRACE_COLORS = {"original": "red", "improved": "orange", "recursive": "green"}
+# Recommendations containing any of these are rendered as SQL code
+_SQL_KEYWORDS_RE = re.compile(r"CREATE INDEX|SELECT|ANALYZE")
+
 # Custom CSS for Swiss Design aesthetic
-st.markdown("""
+_SWISS_CSS = """
 <style>
     /* Swiss Design Typography and Layout */
     .main-header {
@@ -141,14 +174,26 @@ st.markdown("""
         margin: 1rem 0;
     }
 </style>
-""", unsafe_allow_html=True)
+"""
+
+
+# Streamlit drops elements that are not re-emitted on a rerun, so the style
+# block is written every run
+st.markdown(_SWISS_CSS, unsafe_allow_html=True)
+
+
+# Static header markup, emitted as one element per rerun
+_HEADER_HTML = (
+    '<h1 class="main-header">SQL Observability Copilot</h1>\n'
+    '<p class="subtitle">AI-powered performance analysis and optimization recommendations</p>'
+)
+_HEADER_NOTICE = "🚀 **MVP Prototype** - Built for e6data hackathon. Fully functional SQL performance analyzer with AI-powered query improvements."
 
 
 def display_header():
     """Display the main header with Swiss design."""
-    st.markdown('<h1 class="main-header">SQL Observability Copilot</h1>', unsafe_allow_html=True)
-    st.markdown('<p class="subtitle">AI-powered performance analysis and optimization recommendations</p>', unsafe_allow_html=True)
-    st.info("🚀 **MVP Prototype** - Built for e6data hackathon. Fully functional SQL performance analyzer with AI-powered query improvements.")
+    st.markdown(_HEADER_HTML, unsafe_allow_html=True)
+    st.info(_HEADER_NOTICE)
 
 
 def display_connection_status():
@@ -161,6 +206,7 @@ def display_connection_status():
         
         with col2:
             if st.button("Test Connection", key="test_conn"):
+                from gemini_client import test_connection
                 with st.spinner("Testing API connection..."):
                     if test_connection():
                         st.success("✅ Connected")
@@ -168,6 +214,113 @@ def display_connection_status():
                         st.error("❌ Connection Failed")
 
 
+def _get_sqlite_collector(db_path: str) -> "SqliteCollector":
+    """Per-session SqliteCollector that keeps its connection open until the path changes."""
+    from collectors.sqlite_collector import SqliteCollector
+    collector = st.session_state.get("_sqlite_coll")
+    if collector is None or collector.db_path != db_path:
+        if collector is not None:
+            collector.close()
+        collector = SqliteCollector(db_path, persistent=True)
+        st.session_state["_sqlite_coll"] = collector
+    return collector
+
+
+def _sqlserver_collector(
+    server: str,
+    database: str,
+    username: str,
+    password: str,
+    driver: str,
+    encrypt: bool,
+    trust_server_cert: bool,
+) -> "SqlServerCollector":
+    """Build a SqlServerCollector for the current connection settings."""
+    # Deliberately not cached: the collector opens a fresh pyodbc connection per call, so a
+    # shared instance would pool nothing and only keep credentials in a process-wide cache
+    # pyodbc is only needed once a SQL Server connection is actually used
+    from collectors.sqlserver_collector import SqlServerCollector
+    return SqlServerCollector(
+        server=server,
+        database=database,
+        username=username,
+        password=password,
+        driver=driver,
+        encrypt=encrypt,
+        trust_server_cert=trust_server_cert,
+    )
+
+
+def _exists_cached(path: str, ttl: float = 30.0) -> bool:
+    """os.path.exists with a short per-session cache for checks made on every rerun."""
+    now = time.time()
+    cache = st.session_state.setdefault("_stat_cache", {})
+    hit = cache.get(path)
+    if hit and now - hit[0] < ttl:
+        return hit[1]
+    exists = os.path.exists(path)
+    cache[path] = (now, exists)
+    return exists
+
+
+@st.fragment
+def _chat_fragment():
+    """Chat panel; runs as a fragment so new messages only rerun this block."""
+    # Initialize chat history
+    if "chat_history" not in st.session_state:
+        st.session_state.chat_history = [
+            {"role": "assistant", "content": "👋 Hi! I'm your SQL performance assistant. How can I help you optimize your database queries today?"}
+        ]
+    
+    chat_history = st.session_state.chat_history
+    
+    # Display chat history
+    with st.container():
+        for message in chat_history:
+            if message["role"] == "user":
+                with st.chat_message("user"):
+                    st.write(message["content"])
+            else:
+                with st.chat_message("assistant"):
+                    st.write(message["content"])
+    
+    # Chat input
+    if prompt := st.chat_input("Ask about SQL performance, query optimization, or database issues..."):
+        # Add user message and show it right away; no rerun needed
+        chat_history.append({"role": "user", "content": prompt})
+        with st.chat_message("user"):
+            st.write(prompt)
+        
+        with st.chat_message("assistant"):
+            try:
+                from gemini_client import DatabaseDiagnostician
+                diagnostician = DatabaseDiagnostician()
+                
+                # Build simplified history of user/response pairs (exclude the latest user input)
+                msgs = chat_history[:-1]
+                pairs = [
+                    {"user": u["content"], "response": a["content"]}
+                    for u, a in zip(msgs, msgs[1:])
+                    if u["role"] == "user" and a["role"] == "assistant"
+                ]
+
+                # Stream the assistant response as tokens arrive
+                reply = st.write_stream(diagnostician.chat_respond_stream(history=pairs, user_message=prompt))
+                chat_history.append({"role": "assistant", "content": str(reply).strip()})
+                
+            except Exception as e:
+                reply = f"Sorry, I encountered an error: {str(e)}"
+                st.write(reply)
+                chat_history.append({"role": "assistant", "content": reply})
+    
+    # Clear chat button
+    if st.button("🗑️ Clear Chat History"):
+        st.session_state.chat_history = [
+            {"role": "assistant", "content": "👋 Hi! I'm your SQL performance assistant. How can I help you optimize your database queries today?"}
+        ]
+        st.rerun()
+
+
 def display_scenario_selector():
     """Display scenario selection interface."""
     st.markdown("### Analysis Mode")
@@ -179,16 +332,12 @@ def display_scenario_selector():
     )
     
     if mode == "📋 Predefined Scenarios":
-        scenarios = list(SAMPLE_DATA.keys())
-        scenario_names = {
-            "slow_select_without_index": "Slow SELECT Query (Missing Index)",
-            "inefficient_join": "Inefficient JOIN Operation"
-        }
+        scenarios = _SCENARIO_KEYS
         
         selected = st.selectbox(
             "Choose a database scenario to analyze:",
             scenarios,
-            format_func=lambda x: scenario_names.get(x, x),
+            format_func=lambda x: _SCENARIO_NAMES.get(x, x),
             key="scenario_select"
         )
         
@@ -200,65 +349,68 @@ def display_scenario_selector():
         
         custom_data = {}
         
-        col1, col2 = st.columns(2)
+        # One form so edits across the fields trigger a single rerun on submit
+        with st.form("custom_query_form", clear_on_submit=False):
+            col1, col2 = st.columns(2)
         
-        with col1:
-            # Query input
-            custom_data["query"] = st.text_area(
-                "SQL Query *",
-                placeholder="SELECT * FROM users WHERE created_at > '2024-01-01'...",
-                height=150,
-                help="The SQL query you want to analyze"
-            )
+            with col1:
+                # Query input
+                custom_data["query"] = st.text_area(
+                    "SQL Query *",
+                    placeholder="SELECT * FROM users WHERE created_at > '2024-01-01'...",
+                    height=150,
+                    help="The SQL query you want to analyze"
+                )
             
-            # Schema input
-            custom_data["schema"] = st.text_area(
-                "Schema Information",
-                placeholder="Table definitions, indexes, constraints...",
-                height=120,
-                help="Table structures, indexes, foreign keys, etc."
-            )
+                # Schema input
+                custom_data["schema"] = st.text_area(
+                    "Schema Information",
+                    placeholder="Table definitions, indexes, constraints...",
+                    height=120,
+                    help="Table structures, indexes, foreign keys, etc."
+                )
             
-            # Config input
-            custom_data["config"] = st.text_area(
-                "Database Configuration",
-                placeholder="work_mem = 4MB\nshared_buffers = 256MB\n...",
-                height=100,
-                help="Relevant database configuration parameters"
-            )
+                # Config input
+                custom_data["config"] = st.text_area(
+                    "Database Configuration",
+                    placeholder="work_mem = 4MB\nshared_buffers = 256MB\n...",
+                    height=100,
+                    help="Relevant database configuration parameters"
+                )
         
-        with col2:
-            # Explain plan input
-            custom_data["explain"] = st.text_area(
-                "Execution Plan",
-                placeholder="EXPLAIN ANALYZE output...",
-                height=150,
-                help="Output from EXPLAIN or EXPLAIN ANALYZE"
-            )
+            with col2:
+                # Explain plan input
+                custom_data["explain"] = st.text_area(
+                    "Execution Plan",
+                    placeholder="EXPLAIN ANALYZE output...",
+                    height=150,
+                    help="Output from EXPLAIN or EXPLAIN ANALYZE"
+                )
             
-            # Logs input
-            custom_data["logs"] = st.text_area(
-                "Query Logs",
-                placeholder="Slow query logs, error messages...",
-                height=120,
-                help="Relevant log entries, slow query logs, errors"
-            )
+                # Logs input
+                custom_data["logs"] = st.text_area(
+                    "Query Logs",
+                    placeholder="Slow query logs, error messages...",
+                    height=120,
+                    help="Relevant log entries, slow query logs, errors"
+                )
             
-            # Stats input
-            custom_data["stats"] = st.text_area(
-                "Table Statistics",
-                placeholder="Row counts, cardinalities, histograms...",
-                height=100,
-                help="Table statistics, row counts, data distribution"
-            )
+                # Stats input
+                custom_data["stats"] = st.text_area(
+                    "Table Statistics",
+                    placeholder="Row counts, cardinalities, histograms...",
+                    height=100,
+                    help="Table statistics, row counts, data distribution"
+                )
         
-        # System metrics
-        custom_data["system"] = st.text_area(
-            "System Metrics (Optional)",
-            placeholder="CPU: 45%, Memory: 78%, Disk I/O: High...",
-            height=80,
-            help="System performance metrics during query execution"
-        )
+            # System metrics
+            custom_data["system"] = st.text_area(
+                "System Metrics (Optional)",
+                placeholder="CPU: 45%, Memory: 78%, Disk I/O: High...",
+                height=80,
+                help="System performance metrics during query execution"
+            )
+            st.form_submit_button("Apply")
         
         # Validation
         if not custom_data["query"].strip():
@@ -293,7 +445,7 @@ def display_scenario_selector():
         
         # Check if sample database exists
         sample_db = "/Users/aryanchandak/projects/e6data_hackathon/sample_ecommerce.db"
-        if os.path.exists(sample_db):
+        if _exists_cached(sample_db):
             if st.button("📊 Use Sample Database", key="use_sample_db"):
                 st.session_state["sqlite_db_path"] = sample_db
                 st.success(f"✅ Using sample database: {sample_db}")
@@ -306,7 +458,7 @@ def display_scenario_selector():
         # Test connection
         if st.button("Test SQLite Connection", key="test_sqlite"):
             if os.path.exists(custom_path):
-                collector = SqliteCollector(custom_path)
+                collector = _get_sqlite_collector(custom_path)
                 if collector.test_connection():
                     st.success("✅ Connected to SQLite database")
                 else:
@@ -425,7 +577,7 @@ LIMIT 20;"""
             if st.button("🚀 Collect Diagnostics", key="sqlite_collect") and is_query_valid and custom_path:
                 if os.path.exists(custom_path):
                     with st.spinner("Collecting diagnostics from SQLite database..."):
-                        collector = SqliteCollector(custom_path)
+                        collector = _get_sqlite_collector(custom_path)
                         sqlite_data = collector.collect_for_query(sql_text, estimated_plan_only=estimated_only)
                         st.session_state["sqlite_collected"] = sqlite_data
                         st.success("✅ Diagnostics collected!")
@@ -466,55 +618,7 @@ LIMIT 20;"""
         st.markdown("### 💬 AI Chat Assistant")
         st.info("💡 Chat with our SQL performance expert! Ask questions about your queries, get optimization tips, or discuss database performance.")
         
-        # Initialize chat history
-        if "chat_history" not in st.session_state:
-            st.session_state.chat_history = [
-                {"role": "assistant", "content": "👋 Hi! I'm your SQL performance assistant. How can I help you optimize your database queries today?"}
-            ]
-        
-        # Display chat history
-        with st.container():
-            for message in st.session_state.chat_history:
-                if message["role"] == "user":
-                    with st.chat_message("user"):
-                        st.write(message["content"])
-                else:
-                    with st.chat_message("assistant"):
-                        st.write(message["content"])
-        
-        # Chat input
-        if prompt := st.chat_input("Ask about SQL performance, query optimization, or database issues..."):
-            # Add user message
-            st.session_state.chat_history.append({"role": "user", "content": prompt})
-            
-            try:
-                diagnostician = DatabaseDiagnostician()
-                
-                # Build simplified history of user/response pairs (exclude the latest user input)
-                pairs = []
-                pending_user = None
-                for m in st.session_state.chat_history[:-1]:
-                    if m["role"] == "user":
-                        pending_user = m["content"]
-                    elif m["role"] == "assistant" and pending_user is not None:
-                        pairs.append({"user": pending_user, "response": m["content"]})
-                        pending_user = None
-
-                # Get assistant response using simplified protocol
-                reply = diagnostician.chat_respond(history=pairs, user_message=prompt)
-                st.session_state.chat_history.append({"role": "assistant", "content": reply})
-                
-            except Exception as e:
-                st.session_state.chat_history.append({"role": "assistant", "content": f"Sorry, I encountered an error: {str(e)}"})
-            
-            st.rerun()
-        
-        # Clear chat button
-        if st.button("🗑️ Clear Chat History"):
-            st.session_state.chat_history = [
-                {"role": "assistant", "content": "👋 Hi! I'm your SQL performance assistant. How can I help you optimize your database queries today?"}
-            ]
-            st.rerun()
+        _chat_fragment()
         
         return {"mode": "chat", "data": None, "valid": False}
 
@@ -532,16 +636,19 @@ LIMIT 20;"""
                 "trust": True,
             }
         conn = st.session_state["sqlserver"]
-        col1, col2 = st.columns(2)
-        with col1:
-            conn["server"] = st.text_input("Server,Port", value=conn["server"])    
-            conn["database"] = st.text_input("Database", value=conn["database"])    
-            conn["username"] = st.text_input("Username", value=conn["username"])    
-        with col2:
-            conn["password"] = st.text_input("Password", value=conn["password"], type="password")
-            conn["driver"] = st.text_input("ODBC Driver", value=conn["driver"])    
-            conn["encrypt"] = st.checkbox("Encrypt", value=conn["encrypt"])    
-            conn["trust"] = st.checkbox("Trust Server Certificate", value=conn["trust"])    
+        # Connection fields are batched in a form: one rerun on Apply instead of one per edit
+        with st.form("sqlserver_conn", clear_on_submit=False):
+            col1, col2 = st.columns(2)
+            with col1:
+                conn["server"] = st.text_input("Server,Port", value=conn["server"])    
+                conn["database"] = st.text_input("Database", value=conn["database"])    
+                conn["username"] = st.text_input("Username", value=conn["username"])    
+            with col2:
+                conn["password"] = st.text_input("Password", value=conn["password"], type="password")
+                conn["driver"] = st.text_input("ODBC Driver", value=conn["driver"])    
+                conn["encrypt"] = st.checkbox("Encrypt", value=conn["encrypt"])    
+                conn["trust"] = st.checkbox("Trust Server Certificate", value=conn["trust"])    
+            st.form_submit_button("Apply")
 
         st.markdown("### Query")
         sql_text = st.text_area("SQL to analyze", height=140, placeholder="SELECT TOP 100 * FROM sys.objects ORDER BY create_date DESC;")
@@ -550,7 +657,7 @@ LIMIT 20;"""
         live_state = {"valid": bool(sql_text.strip()), "data": None}
         with cols[0]:
             if st.button("Test Connection", key="live_test_conn"):
-                collector = SqlServerCollector(
+                collector = _sqlserver_collector(
                     server=conn["server"],
                     database=conn["database"],
                     username=conn["username"],
@@ -567,7 +674,7 @@ LIMIT 20;"""
         with cols[1]:
             if st.button("Collect Diagnostics", key="live_collect") and sql_text.strip():
                 with st.spinner("Collecting diagnostics from SQL Server..."):
-                    collector = SqlServerCollector(
+                    collector = _sqlserver_collector(
                         server=conn["server"],
                         database=conn["database"],
                         username=conn["username"],
@@ -591,23 +698,31 @@ LIMIT 20;"""
         return {"mode": "live", "data": None, "valid": False}
 
 
+def _truncate_for_display(text: str, head: int = 4000, tail: int = 2000) -> str:
+    """Keep the head and tail of a large text blob for on-page display."""
+    if len(text) <= head + tail:
+        return text
+    omitted = len(text) - head - tail
+    return f"{text[:head]}\n... ({omitted} characters omitted) ...\n{text[-tail:]}"
+
+
 def display_query_preview(scenario_key):
     """Display the query and basic info for the selected scenario."""
-    data = SAMPLE_DATA[scenario_key]
+    data = _SCENARIO_PREVIEWS[scenario_key]
     
     st.markdown("### Query Preview")
     
     # Query
     with st.expander("📝 SQL Query", expanded=True):
-        st.code(data["query"].strip(), language="sql")
+        st.code(data["query"], language="sql")
     
     # Execution plan preview
     with st.expander("📊 Execution Plan", expanded=False):
-        st.code(data["explain"].strip(), language="text")
+        st.code(data["explain"], language="text")
     
     # Schema info
     with st.expander("🗄️ Schema Information", expanded=False):
-        st.code(data["schema"].strip(), language="text")
+        st.code(_truncate_for_display(data["schema"]), language="text")
 
 
 def display_analysis_results(diagnosis):
@@ -645,7 +760,7 @@ def display_analysis_results(diagnosis):
         st.markdown("### 🚨 Performance Bottlenecks")
         for i, bottleneck in enumerate(bottlenecks, 1):
             severity = bottleneck.get('severity', 'Medium')
-            severity_color = {"High": "🔴", "Medium": "🟠", "Low": "🟡"}.get(severity, "🟠")
+            severity_color = _SEVERITY_ICON.get(severity, "🟠")
             with st.container():
                 st.markdown(f"**{i}. {severity_color} {bottleneck.get('type', 'Unknown')} ({severity} Severity)**")
                 st.markdown(f"_{bottleneck.get('description', 'No description')}_")
@@ -669,7 +784,7 @@ def display_analysis_results(diagnosis):
                 
                 # Check if it's SQL code and format appropriately
                 description = rec.get('description', 'No description')
-                if 'CREATE INDEX' in description or 'SELECT' in description or 'ANALYZE' in description:
+                if _SQL_KEYWORDS_RE.search(description):
                     st.code(description, language="sql")
                 else:
                     st.markdown(description)
@@ -682,17 +797,38 @@ def display_analysis_results(diagnosis):
             st.info(f"💡 {comment}")
 
 
+_ELAPSED_MARKER = "Execution elapsed:"
+_ELAPSED_PATTERNS = tuple(
+    re.compile(p, re.IGNORECASE)
+    for p in (
+        r"Execution elapsed:\s*([0-9.]+)\s*ms",
+        r"elapsed:?\s*([0-9.]+)\s*ms",
+        r"([0-9.]+)\s*ms\s*elapsed",
+    )
+)
+
+
+@lru_cache(maxsize=256)
 def _extract_elapsed_ms_from_logs(log_text: str):
-    """Extract elapsed ms from collector logs."""
+    """Extract elapsed ms from collector logs (memoized on the log text)."""
+    text = log_text or ""
+    # Fast path: collectors write "Execution elapsed: <n> ms" near the end of
+    # their logs, so find it from the tail and slice the number out directly.
+    marker = text.rfind(_ELAPSED_MARKER)
+    if marker != -1:
+        start = marker + len(_ELAPSED_MARKER)
+        end = text.find(" ms", start)
+        if end != -1:
+            try:
+                return float(text[start:end])
+            except ValueError:
+                pass
+    # Fallback for other log formats; nothing to match without an "ms" unit
+    if "ms" not in text.lower():
+        return None
     try:
-        patterns = [
-            r"Execution elapsed:\s*([0-9.]+)\s*ms",
-            r"elapsed:?\s*([0-9.]+)\s*ms",
-            r"([0-9.]+)\s*ms\s*elapsed",
-        ]
-        text = log_text or ""
-        for p in patterns:
-            m = re.search(p, text, re.IGNORECASE)
+        for pattern in _ELAPSED_PATTERNS:
+            m = pattern.search(text)
             if m:
                 return float(m.group(1))
     except Exception:
@@ -712,6 +848,38 @@ def initialize_improvement_tracking():
         st.session_state.baseline_selection = "Original"
     if "improved_versions" not in st.session_state:
         st.session_state.improved_versions = []
+    if "_ms_buf" not in st.session_state:
+        # Running plot series of the timed iterations, appended to by add_iteration_to_history
+        st.session_state["_it_buf"] = array("i")
+        st.session_state["_ms_buf"] = array("d")
+        st.session_state["_type_buf"] = []
+        for item in st.session_state.improvement_history:
+            _append_to_timing_buffers(item["iteration"], item["execution_time_ms"], item["type"])
+    if "iteration_context_parts" not in st.session_state:
+        # One summary line per iteration, joined into the recursive-improvement prompt
+        st.session_state.iteration_context_parts = [
+            _format_iteration_context_line(item) for item in st.session_state.improvement_history
+        ]
+    if "original_time_ms" not in st.session_state:
+        # Timing of the first original iteration, for the "vs Original" metric
+        st.session_state.original_time_ms = next(
+            (item["execution_time_ms"] for item in st.session_state.improvement_history if item["type"] == "original"),
+            None,
+        )
+
+
+def _format_iteration_context_line(item: Dict[str, Any]) -> str:
+    """Summarize one history entry for the recursive-improvement context."""
+    return f"Iteration {item['iteration']} ({item['type']}): {item['execution_time_ms']}ms - {item['query'][:100]}..."
+
+
+def _append_to_timing_buffers(iteration: int, execution_time_ms: Optional[float], iteration_type: str):
+    """Record a timed iteration in the running plot series."""
+    if execution_time_ms is None or "_ms_buf" not in st.session_state:
+        return
+    st.session_state["_it_buf"].append(iteration)
+    st.session_state["_ms_buf"].append(execution_time_ms)
+    st.session_state["_type_buf"].append(iteration_type)
 
 
 def add_iteration_to_history(query: str, execution_time_ms: float, diagnosis: dict, iteration_type: str = "improved"):
@@ -725,94 +893,120 @@ def add_iteration_to_history(query: str, execution_time_ms: float, diagnosis: di
         "type": iteration_type  # "original", "improved", "recursive"
     }
     st.session_state.improvement_history.append(iteration_data)
-    # Maintain improved_versions cache for quick UI access
-    try:
-        if "improved_versions" in st.session_state:
-            st.session_state.improved_versions.append({
-                "iteration": iteration_data["iteration"],
-                "type": iteration_type,
-                "execution_time_ms": execution_time_ms,
-                "query": query,
-                "diagnosis": diagnosis,
-            })
-    except Exception:
-        pass
+    # Maintain improved_versions cache for quick UI access (same dict, kept in sync)
+    if "improved_versions" in st.session_state:
+        st.session_state.improved_versions.append(iteration_data)
+    _append_to_timing_buffers(iteration_data["iteration"], execution_time_ms, iteration_type)
+    if "iteration_context_parts" in st.session_state:
+        st.session_state.iteration_context_parts.append(_format_iteration_context_line(iteration_data))
+    st.session_state.pop("_versions_cache", None)
+    if iteration_type == "original" and st.session_state.get("original_time_ms") is None:
+        st.session_state.original_time_ms = execution_time_ms
     st.session_state.current_iteration += 1
 
 
-def plot_improvement_progress():
-    """Create a plotly chart showing SQL improvement progress over iterations."""
-    if not st.session_state.get("improvement_history") or len(st.session_state.improvement_history) < 2:
-        st.info("📊 Run at least 2 iterations to see improvement progress")
-        return
-    
-    history = st.session_state.improvement_history
-    
-    # Extract data for plotting
-    iterations = [item["iteration"] for item in history]
-    execution_times = [item["execution_time_ms"] for item in history if item["execution_time_ms"] is not None]
-    iteration_labels = [item["iteration"] for item in history if item["execution_time_ms"] is not None]
-    types = [item["type"] for item in history if item["execution_time_ms"] is not None]
-    
-    if len(execution_times) < 2:
-        st.info("📊 Need execution time data from at least 2 iterations to show progress")
-        return
+# Plotted points per series; a few hundred is enough to keep the chart's shape at page width
+_MAX_PLOT_POINTS = 500
+
+
+def _lttb_indices(x: List[float], y: List[float], threshold: int) -> List[int]:
+    """
+    Pick point indices with Largest-Triangle-Three-Buckets downsampling.
+
+    The first and last points are always kept; series already at or below
+    the threshold are returned unchanged.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+    
+    every = (n - 2) / (threshold - 2)
+    indices = [0]
+    a = 0
+    for i in range(threshold - 2):
+        # Average point of the next bucket
+        avg_start = int((i + 1) * every) + 1
+        avg_end = min(int((i + 2) * every) + 1, n)
+        avg_len = avg_end - avg_start
+        avg_x = sum(x[avg_start:avg_end]) / avg_len
+        avg_y = sum(y[avg_start:avg_end]) / avg_len
+        
+        # Point in the current bucket forming the largest triangle
+        ax, ay = x[a], y[a]
+        best_area = -1.0
+        best = int(i * every) + 1
+        for j in range(best, int((i + 1) * every) + 1):
+            area = abs((ax - avg_x) * (y[j] - ay) - (ax - x[j]) * (avg_y - ay))
+            if area > best_area:
+                best_area = area
+                best = j
+        indices.append(best)
+        a = best
+    indices.append(n - 1)
+    return indices
+
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def _build_progress_fig(
+    plot_labels: tuple,
+    plot_times: tuple,
+    plot_types: tuple,
+    baseline: Optional[float],
+    improvement_pct: float,
+) -> "go.Figure":
+    """Build the improvement progress figure; memoized on the plotted series."""
+    import plotly.graph_objects as go
     
     # Create the plot
     fig = go.Figure()
     
-    # Add line chart
-    fig.add_trace(go.Scatter(
-        x=iteration_labels,
-        y=execution_times,
+    # Add line chart (all traces use WebGL so large series stay responsive)
+    fig.add_trace(go.Scattergl(
+        x=plot_labels,
+        y=plot_times,
         mode='lines+markers',
         name='Execution Time',
         line=dict(color='#1f77b4', width=3),
         marker=dict(size=8, color='#1f77b4')
     ))
     
-    # Add markers for different types
-    colors = {"original": "red", "improved": "orange", "recursive": "green"}
-    for i, (time, label, type_) in enumerate(zip(execution_times, iteration_labels, types)):
-        fig.add_trace(go.Scatter(
-            x=[label],
-            y=[time],
+    # Add one marker trace per iteration type (in first-seen order)
+    by_type = {}
+    for ms, label, type_ in zip(plot_times, plot_labels, plot_types):
+        xs, ys = by_type.setdefault(type_, ([], []))
+        xs.append(label)
+        ys.append(ms)
+    for type_, (xs, ys) in by_type.items():
+        fig.add_trace(go.Scattergl(
+            x=xs,
+            y=ys,
             mode='markers',
             name=type_.title(),
-            marker=dict(size=12, color=colors.get(type_, "blue")),
-            showlegend=(i == 0 or type_ not in [t["type"] for t in history[:i]])
+            marker=dict(size=12, color=_TRACE_COLORS.get(type_, "blue"))
         ))
     
     # Add original baseline line if available
-    original_items = [item for item in history if item.get("type") == "original" and item.get("execution_time_ms") is not None]
-    if original_items:
-        baseline = original_items[0]["execution_time_ms"]
-        if execution_times:
-            fig.add_trace(go.Scatter(
-                x=iteration_labels,
-                y=[baseline] * len(iteration_labels),
-                mode='lines',
-                name='Original Baseline',
-                line=dict(color='#d62728', width=2, dash='dash')
-            ))
+    if baseline is not None:
+        # Single flat reference line: SVG is cheaper here than a WebGL trace
+        fig.add_trace(go.Scatter(
+            x=plot_labels,
+            y=[baseline] * len(plot_labels),
+            mode='lines',
+            name='Original Baseline',
+            line=dict(color='#d62728', width=2, dash='dash')
+        ))
 
-    # Calculate improvement percentage
-    if len(execution_times) >= 2:
-        initial_time = execution_times[0]
-        final_time = execution_times[-1]
-        improvement_pct = ((initial_time - final_time) / initial_time) * 100
-        
-        # Add improvement annotation
-        fig.add_annotation(
-            x=iteration_labels[-1],
-            y=execution_times[-1],
-            text=f"Total Improvement: {improvement_pct:.1f}%",
-            showarrow=True,
-            arrowhead=2,
-            bgcolor="rgba(255,255,255,0.8)",
-            bordercolor="#333",
-            borderwidth=1
-        )
+    # Add improvement annotation (LTTB always keeps the last point)
+    fig.add_annotation(
+        x=plot_labels[-1],
+        y=plot_times[-1],
+        text=f"Total Improvement: {improvement_pct:.1f}%",
+        showarrow=True,
+        arrowhead=2,
+        bgcolor="rgba(255,255,255,0.8)",
+        bordercolor="#333",
+        borderwidth=1
+    )
     
     # Update layout with Swiss design aesthetics
     fig.update_layout(
@@ -833,32 +1027,103 @@ def plot_improvement_progress():
             xanchor="left",
             x=0.01
         ),
-        margin=dict(l=0, r=0, t=50, b=0)
+        margin=dict(l=0, r=0, t=50, b=0),
+        uirevision="const"  # keep pan/zoom across reruns
     )
     
     # Update axes
     fig.update_xaxes(showgrid=True, gridwidth=1, gridcolor='#e0e0e0')
     fig.update_yaxes(showgrid=True, gridwidth=1, gridcolor='#e0e0e0')
     
+    return fig
+
+
+def _progress_kpi_html(total_iterations: int, improvement_pct: float, delta_ms: float, best_ms: float) -> str:
+    """Summary stats below the progress chart as one metric-grid block."""
+    delta_class = "status-success" if delta_ms >= 0 else "status-error"
+    return (
+        '<div class="metric-grid">'
+        f'<div class="metric-card">Total Iterations<h3>{total_iterations}</h3></div>'
+        f'<div class="metric-card">Time Improvement<h3>{improvement_pct:.1f}%</h3>'
+        f'<span class="{delta_class}">{delta_ms:+.1f}ms</span></div>'
+        f'<div class="metric-card">Best Time<h3>{best_ms:.1f}ms</h3></div>'
+        '</div>'
+    )
+
+
+def plot_improvement_progress():
+    """Create a plotly chart showing SQL improvement progress over iterations."""
+    state = st.session_state
+    history = state.get("improvement_history") or []
+    if len(history) < 2:
+        st.info("📊 Run at least 2 iterations to see improvement progress")
+        return
+    
+    # Plot series are maintained incrementally by add_iteration_to_history
+    execution_times = state["_ms_buf"].tolist()
+    iteration_labels = state["_it_buf"].tolist()
+    types = state["_type_buf"]
+    
+    if len(execution_times) < 2:
+        st.info("📊 Need execution time data from at least 2 iterations to show progress")
+        return
+    
+    # Long histories are downsampled before the figure cache lookup, so both the
+    # cache key and the payload sent to the browser stay bounded; summary stats use the full data
+    plot_idx = _lttb_indices(iteration_labels, execution_times, _MAX_PLOT_POINTS)
+    if len(plot_idx) < len(execution_times):
+        # LTTB keeps the endpoints; also snap in the best and worst runs so they stay visible
+        extremes = {
+            execution_times.index(min(execution_times)),
+            execution_times.index(max(execution_times)),
+        }
+        plot_idx = sorted(extremes.union(plot_idx))
+    plot_labels = tuple(iteration_labels[j] for j in plot_idx)
+    plot_times = tuple(execution_times[j] for j in plot_idx)
+    plot_types = tuple(types[j] for j in plot_idx)
+    
+    # Original timing for the dashed baseline line, if recorded; the type buffer
+    # only holds timed iterations, so no rescan of the full history is needed
+    baseline = execution_times[types.index("original")] if "original" in types else None
+    
+    # Calculate improvement percentage
+    initial_time = execution_times[0]
+    final_time = execution_times[-1]
+    improvement_pct = ((initial_time - final_time) / initial_time) * 100
+    
+    fig = _build_progress_fig(
+        plot_labels,
+        plot_times,
+        plot_types,
+        baseline,
+        improvement_pct,
+    )
     st.plotly_chart(fig, use_container_width=True)
     
     # Show summary stats
-    col1, col2, col3 = st.columns(3)
-    with col1:
-        st.metric("Total Iterations", len(history))
-    with col2:
-        if len(execution_times) >= 2:
-            st.metric("Time Improvement", f"{improvement_pct:.1f}%", 
-                     delta=f"{initial_time - final_time:.1f}ms")
-    with col3:
-        st.metric("Best Time", f"{min(execution_times):.1f}ms")
+    st.markdown(
+        _progress_kpi_html(len(history), improvement_pct, initial_time - final_time, min(execution_times)),
+        unsafe_allow_html=True,
+    )
+
+
+def _set_baseline_query(query: str) -> None:
+    """Use ``query`` as the starting point for the next improvement."""
+    if st.session_state.base_query_data is None:
+        st.session_state.base_query_data = {}
+    st.session_state.base_query_data["query"] = query
 
 
 def _get_improvement_versions():
     """Return labeled versions from history including original and improvements."""
+    history = st.session_state.improvement_history
+    cached = st.session_state.get("_versions_cache")
+    # History is append-only between clears, so its length identifies the cached list
+    if cached is not None and cached[0] == len(history):
+        return cached[1]
     versions = []
     improved_counter = 0
-    for item in st.session_state.improvement_history:
+    for item in history:
         label = ""
         if item.get("type") == "original":
             label = "Original"
@@ -876,14 +1141,20 @@ def _get_improvement_versions():
             "query": item.get("query"),
             "diagnosis": item.get("diagnosis"),
         })
+    st.session_state._versions_cache = (len(history), versions)
     return versions
 
 
 def _format_chat_analysis_xml(xml_content: str) -> str:
     """Parse and format XML analysis content for chat display."""
     try:
-        import xml.etree.ElementTree as ET
-        root = ET.fromstring(xml_content)
+        try:
+            # libxml2-backed parser; entity expansion disabled for model output
+            from lxml import etree as ET
+            root = ET.fromstring(xml_content, ET.XMLParser(resolve_entities=False))
+        except ImportError:
+            import xml.etree.ElementTree as ET
+            root = ET.fromstring(xml_content)
         
         markdown_parts = []
         
@@ -899,12 +1170,11 @@ def _format_chat_analysis_xml(xml_content: str) -> str:
             bottlenecks = bottlenecks_elem.findall("bottleneck")
             if bottlenecks:
                 markdown_parts.append("### 🚨 **Performance Bottlenecks**")
-                for bottleneck in bottlenecks:
-                    b_type = bottleneck.get("type", "Unknown")
-                    severity = bottleneck.get("severity", "Medium")
-                    description = bottleneck.text.strip() if bottleneck.text else ""
-                    severity_icon = {"High": "🔴", "Medium": "🟠", "Low": "🟡"}.get(severity, "🟠")
-                    markdown_parts.append(f"- {severity_icon} **{b_type}** ({severity}): {description}")
+                markdown_parts.extend(
+                    f"- {_SEVERITY_ICON.get(b.get('severity', 'Medium'), '🟠')} **{b.get('type', 'Unknown')}** "
+                    f"({b.get('severity', 'Medium')}): {(b.text or '').strip()}"
+                    for b in bottlenecks
+                )
                 markdown_parts.append("")
         
         # Recommendations
@@ -913,12 +1183,11 @@ def _format_chat_analysis_xml(xml_content: str) -> str:
             recommendations = recommendations_elem.findall("recommendation")
             if recommendations:
                 markdown_parts.append("### 💡 **Recommendations**")
-                for rec in recommendations:
-                    r_type = rec.get("type", "Unknown")
-                    priority = rec.get("priority", "Medium")
-                    description = rec.text.strip() if rec.text else ""
-                    priority_icon = {"High": "🔥", "Medium": "⚡", "Low": "💡"}.get(priority, "⚡")
-                    markdown_parts.append(f"- {priority_icon} **{r_type}** ({priority}): {description}")
+                markdown_parts.extend(
+                    f"- {_PRIORITY_ICON.get(rec.get('priority', 'Medium'), '⚡')} **{rec.get('type', 'Unknown')}** "
+                    f"({rec.get('priority', 'Medium')}): {(rec.text or '').strip()}"
+                    for rec in recommendations
+                )
                 markdown_parts.append("")
         
         # Tips
@@ -927,9 +1196,7 @@ def _format_chat_analysis_xml(xml_content: str) -> str:
             tips = tips_elem.findall("tip")
             if tips:
                 markdown_parts.append("### 🎯 **Pro Tips**")
-                for tip in tips:
-                    tip_text = tip.text.strip() if tip.text else ""
-                    markdown_parts.append(f"- 💡 {tip_text}")
+                markdown_parts.extend(f"- 💡 {(tip.text or '').strip()}" for tip in tips)
         
         return "\n".join(markdown_parts)
         
@@ -938,31 +1205,29 @@ def _format_chat_analysis_xml(xml_content: str) -> str:
         return f"Analysis response (XML parsing failed): {xml_content}"
 
 
+# One scan each for the tagged blocks a chat response may carry
+_ANALYSIS_BLOCK_RE = re.compile(r"<analysis>.*?</analysis>", re.DOTALL)
+_RESPONSE_BLOCK_RE = re.compile(r"<response>(.*?)</response>", re.DOTALL)
+
+
 def _process_chat_response(raw_response: str, conversation_started: bool) -> str:
     """Process chat response based on conversation state and format."""
     try:
         if not conversation_started:
             # First interaction - check for XML analysis format
-            if "<analysis>" in raw_response and "</analysis>" in raw_response:
-                # Extract and format XML content
-                start_idx = raw_response.find("<analysis>")
-                end_idx = raw_response.find("</analysis>") + len("</analysis>")
-                xml_content = raw_response[start_idx:end_idx]
-                
+            m = _ANALYSIS_BLOCK_RE.search(raw_response)
+            if m:
                 # Parse XML content and return formatted response
-                return _format_chat_analysis_xml(xml_content)
+                return _format_chat_analysis_xml(m.group(0))
             else:
                 # Regular response for first interaction - clean any XML tags
                 return clean_response_from_xml_tags(raw_response)
         else:
             # Subsequent interactions - look for simple response tags
-            if "<response>" in raw_response and "</response>" in raw_response:
-                # Extract content between response tags
-                start_idx = raw_response.find("<response>") + len("<response>")
-                end_idx = raw_response.find("</response>")
-                response_content = raw_response[start_idx:end_idx].strip()
-                # Clean any remaining XML tags from the content
-                return clean_response_from_xml_tags(response_content)
+            m = _RESPONSE_BLOCK_RE.search(raw_response)
+            if m:
+                # Clean any remaining XML tags from the content between response tags
+                return clean_response_from_xml_tags(m.group(1).strip())
             else:
                 # Fallback to cleaned raw response if no tags found
                 return clean_response_from_xml_tags(raw_response)
@@ -971,12 +1236,10 @@ def _process_chat_response(raw_response: str, conversation_started: bool) -> str
         # Fallback to cleaned raw response on any error
         return clean_response_from_xml_tags(raw_response)
 
+
 def run_analysis(data_source):
     """Run the AI analysis for the selected scenario or custom data."""
     try:
-        # Initialize diagnostician
-        diagnostician = DatabaseDiagnostician()
-        
         # Get data based on source type
         if isinstance(data_source, str):
             # Predefined scenario
@@ -985,6 +1248,15 @@ def run_analysis(data_source):
             # Custom data
             db_data = data_source
         
+        # Trivially bad plans are diagnosed locally, skipping the LLM round-trip
+        diagnosis = try_rule_based(db_data)
+        if diagnosis is not None:
+            return diagnosis
+        
+        # Initialize diagnostician
+        from gemini_client import DatabaseDiagnostician
+        diagnostician = DatabaseDiagnostician()
+        
         # Run analysis
         with st.spinner("🤖 Analyzing database performance..."):
             diagnosis = diagnostician.analyze_performance(db_data)
@@ -996,6 +1268,15 @@ def run_analysis(data_source):
         return None
 
 
+# Anchored at the start, so only the leading whitespace and keyword are inspected
+_SELECT_PREFIX_RE = re.compile(r"\s*select", re.IGNORECASE)
+
+
+def _is_select(query: str) -> bool:
+    """Whether the query's first keyword is SELECT, without lowering the whole string."""
+    return _SELECT_PREFIX_RE.match(query) is not None
+
+
 def handle_query_comparison():
     """Handle the execution and comparison of original vs improved queries."""
     db_path = st.session_state.get("sqlite_db_path")
@@ -1006,21 +1287,22 @@ def handle_query_comparison():
         st.error("Missing required data for comparison")
         return
     
-    collector = SqliteCollector(db_path)
+    collector = _get_sqlite_collector(db_path)
+    original_query = base_data.get("query", "")
+    improved_query = improved.get("improved_query", "")
     
-    # Run original query
-    with st.spinner("Running original query..."):
-        original_query = base_data.get("query", "")
-        base_exec = collector.collect_for_query(original_query, estimated_plan_only=False)
+    # Run improved query only if valid SELECT
+    run_improved = bool(improved_query) and _is_select(improved_query)
+    if not run_improved:
+        st.warning("Improved query is not a valid SELECT. Skipping execution.")
     
-    # Run improved query (only if valid SELECT)
-    with st.spinner("Running improved query..."):
-        improved_query = improved.get("improved_query", "")
-        if not improved_query or not improved_query.strip().lower().startswith("select"):
-            st.warning("Improved query is not a valid SELECT. Skipping execution.")
-            improved_exec = {"logs": "", "result_preview": ""}
-        else:
+    # Timed runs stay sequential so neither query competes with the other for CPU, disk or cache
+    with st.spinner("Running original and improved queries..."):
+        base_exec = collector.collect_for_query(original_query, estimated_plan_only=False)
+        if run_improved:
             improved_exec = collector.collect_for_query(improved_query, estimated_plan_only=False)
+        else:
+            improved_exec = {"logs": "", "result_preview": ""}
     
     # Extract execution times
     base_ms = _extract_elapsed_ms_from_logs(base_exec.get("logs", ""))
@@ -1029,6 +1311,7 @@ def handle_query_comparison():
     # Add improved query to history (only if executed and timed)
     if imp_ms is not None:
         # Analyze the improved query
+        from gemini_client import DatabaseDiagnostician
         diagnostician = DatabaseDiagnostician()
         improved_diagnosis = diagnostician.analyze_performance(improved_exec)
         
@@ -1094,19 +1377,17 @@ def handle_recursive_improvement():
         st.error("Base query data not found")
         return
     
-    # Create enhanced data using latest query + all original diagnostics
-    enhanced_data = dict(base_data)  # Copy original data
-    enhanced_data["query"] = latest_iteration["query"]  # Use latest improved query
-    
-    # Add comprehensive context from all iterations
-    iteration_context = "\n".join([
-        f"Iteration {i['iteration']} ({i['type']}): {i['execution_time_ms']}ms - {i['query'][:100]}..."
-        for i in st.session_state.improvement_history
-    ])
+    # Add comprehensive context from all iterations (lines kept by add_iteration_to_history)
+    iteration_context = "\n".join(st.session_state.iteration_context_parts)
     
-    enhanced_data["improvement_history"] = iteration_context
+    # Overlay the latest query + iteration context on the original diagnostics without copying them
+    enhanced_data = ChainMap(
+        {"query": latest_iteration["query"], "improvement_history": iteration_context},
+        base_data,
+    )
     
     # Generate recursive improvement
+    from gemini_client import DatabaseDiagnostician
     diagnostician = DatabaseDiagnostician()
     
     with st.spinner("Generating recursively improved query..."):
@@ -1122,10 +1403,10 @@ def handle_recursive_improvement():
     st.success(f"🔄 Generated recursively improved query (iteration {st.session_state.current_iteration + 1})")
     
     # Automatically run and compare the new query
-    if improved.get("improved_query") and improved.get("improved_query").strip().lower().startswith("select"):
+    if improved.get("improved_query") and _is_select(improved.get("improved_query")):
         db_path = st.session_state.get("sqlite_db_path")
         if db_path:
-            collector = SqliteCollector(db_path)
+            collector = _get_sqlite_collector(db_path)
             
             with st.spinner("Testing recursively improved query..."):
                 recursive_exec = collector.collect_for_query(improved.get("improved_query"), estimated_plan_only=False)
@@ -1210,12 +1491,13 @@ def main():
                 with st.expander("📄 Result Preview"):
                     st.code(sqlite_data.get("result_preview"), language="text")
             with st.expander("🗄️ Schema"):
-                st.text(sqlite_data.get("schema", "(no schema)"))
+                st.text(_truncate_for_display(sqlite_data.get("schema", "(no schema)")))
             with st.expander("📈 Stats"):
                 st.text(sqlite_data.get("stats", "(no stats)"))
             with st.expander("📝 Logs"):
                 log_text = sqlite_data.get("logs", "(no logs)")
-                st.code(log_text, language="text")
+                # Full logs are only sent through the download button
+                st.code(_truncate_for_display(log_text), language="text")
                 st.download_button("Download Logs", log_text, file_name="sqlite_logs.txt")
 
             st.markdown("---")
@@ -1224,8 +1506,9 @@ def main():
             c1, c2, c3 = st.columns([1, 2, 1])
             with c2:
                 if st.button("🚀 Collect Diagnostics", key="sqlite_collect_step", use_container_width=True):
-                    # Store base query data for future iterations
-                    st.session_state.base_query_data = sqlite_data
+                    # Store base query data for future iterations; own copy so baseline
+                    # changes can update it in place without touching the collected data
+                    st.session_state.base_query_data = dict(sqlite_data)
                     st.session_state['diagnostics_collected'] = True
                     st.success("✅ Diagnostics collected! You can now analyze performance.")
             
@@ -1264,6 +1547,7 @@ def main():
                 
                 with col1:
                     if st.button("✨ Generate Improved Query", key="sqlite_improve", use_container_width=True):
+                        from gemini_client import DatabaseDiagnostician
                         diagnostician = DatabaseDiagnostician()
                         
                         # Get the most recent query and diagnosis for recursive improvement
@@ -1307,16 +1591,13 @@ def main():
                     # Sidebar: version picker and actions
                     with st.sidebar:
                         st.markdown("### 🧪 Compare & Select Version")
-                        labels = [v["label"] for v in versions]
-                        if labels:
-                            idx = st.selectbox("Choose version to inspect", list(range(len(labels))), format_func=lambda i: labels[i])
+                        if versions:
+                            idx = st.selectbox("Choose version to inspect", range(len(versions)), format_func=lambda i: versions[i]["label"])
                             selected = versions[idx]
                             st.metric("Runtime (ms)", selected.get("execution_time_ms", "n/a"))
                             if st.button("Use this as baseline for next improvement"):
                                 # Set as baseline for next improvement iteration
-                                st.session_state.base_query_data = dict(st.session_state.base_query_data or {})
-                                if st.session_state.base_query_data is not None:
-                                    st.session_state.base_query_data["query"] = selected["query"]
+                                _set_baseline_query(selected["query"])
                                 st.session_state.baseline_selection = selected["label"]
                                 st.success(f"Baseline set to {selected['label']}")
                         
@@ -1326,12 +1607,10 @@ def main():
                             if valid:
                                 best = min(valid, key=lambda v: v["execution_time_ms"]) 
                                 if st.button("✅ Use Best Query"):
-                                    st.session_state.base_query_data = dict(st.session_state.base_query_data or {})
-                                    st.session_state.base_query_data["query"] = best["query"]
+                                    _set_baseline_query(best["query"])
                                     st.success(f"Best query selected: {best['label']} ({best['execution_time_ms']:.2f} ms)")
 
                     # Main area: dropdown to select and view any SQL version
-                    versions = _get_improvement_versions()
                     if versions:
                         # Add session state for selected version if not exists
                         if "selected_version_idx" not in st.session_state:
@@ -1340,11 +1619,11 @@ def main():
                         # Dropdown to select version
                         col1, col2, col3, col4 = st.columns([2, 1, 1, 1])
                         with col1:
-                            labels = [f"{v['label']} ({v.get('execution_time_ms', 'n/a')} ms)" for v in versions]
+                            # Labels are formatted on demand from the cached versions list
                             selected_idx = st.selectbox(
                                 "Select SQL Version to View:",
-                                options=list(range(len(labels))),
-                                format_func=lambda i: labels[i],
+                                options=range(len(versions)),
+                                format_func=lambda i: f"{versions[i]['label']} ({versions[i].get('execution_time_ms', 'n/a')} ms)",
                                 index=st.session_state.selected_version_idx,
                                 key="version_dropdown"
                             )
@@ -1361,7 +1640,7 @@ def main():
                         with col3:
                             # Show improvement vs original
                             if len(versions) > 1 and runtime is not None:
-                                original_time = next((v.get("execution_time_ms") for v in versions if v.get("type") == "original"), None)
+                                original_time = st.session_state.get("original_time_ms")
                                 if original_time is not None and original_time != runtime:
                                     improvement = ((original_time - runtime) / original_time) * 100
                                     st.metric("vs Original", f"{improvement:+.1f}%")
@@ -1369,9 +1648,7 @@ def main():
                         with col4:
                             # Use selected version as baseline button
                             if st.button("🎯 Use as Baseline", key="use_selected_baseline", help="Use this query as the starting point for the next improvement"):
-                                st.session_state.base_query_data = dict(st.session_state.base_query_data or {})
-                                if st.session_state.base_query_data is not None:
-                                    st.session_state.base_query_data["query"] = selected_version["query"]
+                                _set_baseline_query(selected_version["query"])
                                 st.session_state.baseline_selection = selected_version["label"]
                                 st.success(f"✅ Baseline set to {selected_version['label']}")
                         
@@ -1404,6 +1681,8 @@ def main():
             if st.button("🗑️ Clear Improvement History"):
                 st.session_state.improvement_history = []
                 st.session_state.current_iteration = 0
+                for key in ("_it_buf", "_ms_buf", "_type_buf", "iteration_context_parts", "_versions_cache", "original_time_ms"):
+                    st.session_state.pop(key, None)
                 st.session_state.pop('improved_sql', None)
                 st.session_state.pop('current_diagnosis', None)
                 st.success("Improvement history cleared")
@@ -0,0 +1,103 @@
+"""
+Tests for the rule-based SQLite diagnosis, run against real query plans.
+"""
+
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from collectors.sqlite_collector import SqliteCollector
+from rule_based import try_rule_based
+
+
+class TryRuleBasedTest(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.db_path = tempfile.mkstemp(suffix=".db")
+        os.close(handle)
+        with sqlite3.connect(self.db_path) as conn:
+            conn.executescript(
+                """
+                CREATE TABLE users (id INTEGER PRIMARY KEY, email TEXT, name TEXT, age INTEGER);
+                CREATE TABLE orders (id INTEGER PRIMARY KEY, user_id INTEGER, total REAL);
+                CREATE INDEX idx_orders_user_id ON orders(user_id);
+                """
+            )
+
+    def tearDown(self):
+        os.remove(self.db_path)
+
+    def diagnose(self, sql):
+        data = SqliteCollector(self.db_path).collect_for_query(sql, estimated_plan_only=True)
+        return try_rule_based(data)
+
+    def try_plan(self, sql):
+        """Rule result for ``sql`` with a full-scan plan of users forced in."""
+        data = {
+            "query": sql,
+            "explain": "2|0|0|SCAN users",
+            "schema": SqliteCollector(self.db_path).collect_for_query(sql, estimated_plan_only=True)["schema"],
+        }
+        return try_rule_based(data)
+
+    def recommended_index(self, sql):
+        diagnosis = self.diagnose(sql)
+        self.assertIsNotNone(diagnosis, sql)
+        return diagnosis["recommendations"][0]["description"]
+
+    def test_equality_filter(self):
+        self.assertEqual(
+            self.recommended_index("SELECT * FROM users WHERE email = 'a@example.com'"),
+            "CREATE INDEX idx_users_email ON users(email);",
+        )
+
+    def test_alias_resolves_to_table(self):
+        for sql in (
+            "SELECT * FROM users u WHERE u.email = 'a'",
+            "SELECT * FROM users AS u WHERE email = 'a'",
+        ):
+            self.assertEqual(self.recommended_index(sql), "CREATE INDEX idx_users_email ON users(email);")
+
+    def test_equality_columns_before_range(self):
+        self.assertEqual(
+            self.recommended_index("SELECT * FROM users WHERE age > 30 AND name = 'x' AND email IN ('a', 'b')"),
+            "CREATE INDEX idx_users_name_email_age ON users(name, email, age);",
+        )
+
+    def test_between_is_a_range(self):
+        self.assertEqual(
+            self.recommended_index("SELECT * FROM users WHERE age BETWEEN 18 AND 30"),
+            "CREATE INDEX idx_users_age ON users(age);",
+        )
+
+    def test_unindexable_predicates_defer_to_llm(self):
+        for sql in (
+            "SELECT * FROM users WHERE email LIKE '%foo%'",
+            "SELECT * FROM users WHERE name != 'x'",
+            "SELECT * FROM users WHERE name <> 'x'",
+            "SELECT * FROM users WHERE email = 'x' OR name = 'y'",
+            "SELECT * FROM users WHERE NOT email = 'x'",
+            "SELECT * FROM users WHERE lower(email) = 'x'",
+        ):
+            self.assertIsNone(self.diagnose(sql), sql)
+
+    def test_unknown_qualifier_or_column_defers_to_llm(self):
+        self.assertIsNone(self.try_plan("SELECT * FROM users WHERE orders.email = 'a'"))
+        self.assertIsNone(self.try_plan("SELECT * FROM users WHERE missing = 1"))
+
+    def test_indexed_column_defers_to_llm(self):
+        # The schema lists idx_orders_user_id, so a missing index on user_id is not asserted
+        data = SqliteCollector(self.db_path).collect_for_query(
+            "SELECT * FROM orders WHERE user_id = 1", estimated_plan_only=True
+        )
+        data["explain"] = "2|0|0|SCAN orders"
+        self.assertIsNone(try_rule_based(data))
+
+    def test_missing_schema_defers_to_llm(self):
+        data = {"query": "SELECT * FROM users WHERE email = 'a'", "explain": "2|0|0|SCAN users", "schema": ""}
+        self.assertIsNone(try_rule_based(data))
+
+
+if __name__ == "__main__":
+    unittest.main()
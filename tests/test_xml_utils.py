@@ -0,0 +1,58 @@
+"""
+Tests for streaming <response> extraction, checked against the non-streaming path.
+"""
+
+import unittest
+
+from xml_utils import extract_response_from_stream, extract_response_from_text
+
+
+class ExtractResponseFromStreamTest(unittest.TestCase):
+
+    def assertMatchesText(self, chunks):
+        streamed = "".join(extract_response_from_stream(chunks))
+        self.assertEqual(streamed, extract_response_from_text("".join(chunks)), chunks)
+        return streamed
+
+    def test_whole_response_in_one_chunk(self):
+        self.assertEqual(self.assertMatchesText(["<response>Hello there</response>"]), "Hello there")
+
+    def test_tags_split_across_chunks(self):
+        for chunks in (
+            ["<resp", "onse>Hello there</response>"],
+            ["<response>Hello the", "re</res", "ponse>"],
+            ["<response>Hello there<", "/response>"],
+            ["<", "r", "esponse>Hel", "lo there</respons", "e", ">"],
+        ):
+            self.assertEqual(self.assertMatchesText(chunks), "Hello there")
+
+    def test_surrounding_whitespace_is_not_emitted(self):
+        for chunks in (
+            ["<response>\nHel", "lo there\n</res", "ponse>"],
+            ["<response>\n\n", "  Hello", " there", "\n\n  ", "\n</response>"],
+            ["<response>Hello there            ", "            \n</response>"],
+        ):
+            self.assertEqual(self.assertMatchesText(chunks), "Hello there")
+
+    def test_text_outside_the_response_tag_is_dropped(self):
+        self.assertEqual(
+            self.assertMatchesText(["<analysis>internal</analysis>\n<respon", "se>Hi</response>\ntrailing"]),
+            "Hi",
+        )
+
+    def test_no_tag_falls_back_to_cleaning(self):
+        self.assertEqual(
+            self.assertMatchesText(["Plain <b>rep", "ly</b>\n\n\n\nwith gaps  "]),
+            "Plain reply\n\nwith gaps",
+        )
+
+    def test_unterminated_response(self):
+        self.assertEqual(self.assertMatchesText(["<response>\nHel", "lo there\n"]), "Hello there")
+
+    def test_empty_stream(self):
+        self.assertEqual(list(extract_response_from_stream([])), [""])
+        self.assertEqual(extract_response_from_text(""), "")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,12 +3,57 @@ XML utilities for structuring input/output with the LLM.
 Handles creation of XML input tags and parsing of XML output tags.
 """
 
-import xml.etree.ElementTree as ET
-from typing import Dict, List, Optional
-import html
+import copy
+import io
+import re
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional
 
 
-def create_input_xml(data: Dict[str, str]) -> str:
+# Compiled once at import and shared by every clean_response_from_xml_tags call.
+# Known tags and CDATA markers go first, so a stray "<" in the text (e.g. "price < 100")
+# has no tag ">" left to pair with when the generic pass runs.
+_KNOWN_TAG_CLEANUP_RE = re.compile(
+    r'</?(?:analysis|diagnosis|reasoning|bottlenecks?|root_causes?|recommendations?'
+    r'|comments?|tips?|queries?|response)[^>]*>|<!\[CDATA\[|\]\]>',
+    re.IGNORECASE,
+)
+_GENERIC_TAG_CLEANUP_RE = re.compile(r'<[^>]*>')
+_BLANK_LINES_RE = re.compile(r'\n\s*\n\s*\n')
+_SEVERITY_ICONS = {"High": "🔴", "Medium": "🟠", "Low": "🟡"}
+# Fixed pieces of the format_diagnosis_output report
+_REPORT_RULE = "=" * 80
+_REPORT_HEADER = f"{_REPORT_RULE}\nDATABASE PERFORMANCE DIAGNOSIS\n{_REPORT_RULE}\n\n"
+_SECTION_RULE = "-" * 40 + "\n"
+# Input sections sent to the LLM, in prompt order; every tag is emitted even when empty
+_INPUT_TAGS = ("query", "explain", "logs", "schema", "stats", "config", "system")
+# Per-section (tag, CDATA open, CDATA close, empty element) markup, formatted once at import
+_INPUT_SECTIONS = tuple(
+    (tag, f"<{tag}><![CDATA[", f"]]></{tag}>", f"<{tag}></{tag}>") for tag in _INPUT_TAGS
+)
+# Section extraction for parse_diagnosis_xml (first complete block wins)
+_DIAGNOSIS_BLOCK_RE = re.compile(r'<diagnosis>.*?</diagnosis>', re.DOTALL)
+_REASONING_BLOCK_RE = re.compile(r'<reasoning>(.*?)</reasoning>', re.DOTALL)
+# Item tag -> (result list, (attribute, default) pairs); each item also gets a "description"
+_DIAGNOSIS_ITEM_FIELDS = {
+    "bottleneck": ("bottlenecks", (("type", "Unknown"), ("severity", "Medium"))),
+    "root_cause": ("root_causes", (("type", "Unknown"),)),
+    "recommendation": ("recommendations", (("type", "Unknown"), ("priority", "Medium"))),
+}
+
+try:
+    # libxml2-backed parsing. Strict on purpose: recovery would silently truncate text at a raw
+    # "<" or "&" (e.g. SQL in a recommendation) instead of reporting a parse error
+    from lxml import etree as ET
+    _ITERPARSE_OPTIONS = {"resolve_entities": False, "huge_tree": False, "remove_blank_text": True}
+    _XML_PARSE_ERRORS = (ET.XMLSyntaxError,)
+except ImportError:
+    import xml.etree.ElementTree as ET
+    _ITERPARSE_OPTIONS = {}
+    _XML_PARSE_ERRORS = (ET.ParseError,)
+
+
+def create_input_xml(data: Mapping[str, str]) -> str:
     """
     Create XML input structure for the LLM based on available data.
     
@@ -19,32 +64,37 @@ def create_input_xml(data: Dict[str, str]) -> str:
         XML string with all input tags
     """
     
-    # Create root element
-    root = ET.Element("database_info")
-    
-    # Define all possible input tags
-    input_tags = [
-        "query", "explain", "logs", "schema", 
-        "stats", "config", "system"
-    ]
+    # Fixed shape, so the document is filled in from the prebuilt section markup
+    parts = ['<?xml version="1.0" encoding="UTF-8"?>', '<database_info>']
     
     # Add each tag, even if empty
-    for tag in input_tags:
-        element = ET.SubElement(root, tag)
-        if tag in data and data[tag]:
-            # Use CDATA for content that might contain special characters
-            element.text = data[tag].strip()
+    for tag, open_markup, close_markup, empty_markup in _INPUT_SECTIONS:
+        value = (data.get(tag) or "").strip()
+        if value:
+            # CDATA keeps SQL/plan text verbatim; only a literal "]]>" needs splitting
+            parts.append(open_markup + value.replace("]]>", "]]]]><![CDATA[>") + close_markup)
         else:
-            element.text = ""
+            parts.append(empty_markup)
     
-    # Convert to string
-    xml_str = ET.tostring(root, encoding='unicode')
-    
-    # Pretty format manually (since we want to preserve CDATA sections)
-    formatted_xml = '<?xml version="1.0" encoding="UTF-8"?>\n'
-    formatted_xml += xml_str.replace('><', '>\n<')
-    
-    return formatted_xml
+    parts.append("</database_info>")
+    return "\n".join(parts)
+
+
+def _elem_text(elem) -> str:
+    """Stripped text of an element, or "" when it has none."""
+    text = elem.text
+    return text.strip() if text else ""
+
+
+def _empty_diagnosis() -> Dict[str, any]:
+    """Fresh result dict with every diagnosis section present and empty."""
+    return {
+        "reasoning": "",
+        "bottlenecks": [],
+        "root_causes": [],
+        "recommendations": [],
+        "comments": []
+    }
 
 
 def parse_diagnosis_xml(xml_response: str) -> Dict[str, any]:
@@ -57,100 +107,82 @@ def parse_diagnosis_xml(xml_response: str) -> Dict[str, any]:
     Returns:
         Dictionary with parsed diagnosis information
     """
+    # Callers annotate the result in place, so hand out a copy of the cached parse
+    return copy.deepcopy(_parse_diagnosis_cached(xml_response))
+
+
+@lru_cache(maxsize=64)
+def _parse_diagnosis_cached(xml_response: str) -> Dict[str, any]:
+    """Parse one response; repeated responses (retries, reruns) are served from the cache."""
+    result = _empty_diagnosis()
     
-    result = {
-        "reasoning": "",
-        "bottlenecks": [],
-        "root_causes": [],
-        "recommendations": [],
-        "comments": []
-    }
+    # Error replies and partial output carry no diagnosis block; skip the parser entirely
+    if "<diagnosis>" not in xml_response:
+        _apply_reasoning_fallback(result, xml_response, "Could not find <diagnosis> tags in response")
+        return result
+    
+    # Extract the diagnosis section
+    diagnosis_match = _DIAGNOSIS_BLOCK_RE.search(xml_response)
+    if diagnosis_match is None:
+        _apply_reasoning_fallback(result, xml_response, "Could not find <diagnosis> tags in response")
+        return result
+    
+    diagnosis_xml = diagnosis_match.group(0)
     
     try:
-        # Extract the diagnosis section
-        start_tag = "<diagnosis>"
-        end_tag = "</diagnosis>"
-        
-        start_idx = xml_response.find(start_tag)
-        end_idx = xml_response.find(end_tag)
-        
-        if start_idx == -1 or end_idx == -1:
-            raise ValueError("Could not find <diagnosis> tags in response")
-        
-        diagnosis_xml = xml_response[start_idx:end_idx + len(end_tag)]
-        
-        # Parse XML
-        root = ET.fromstring(diagnosis_xml)
-        
-        # Extract reasoning
-        reasoning_elem = root.find("reasoning")
-        if reasoning_elem is not None and reasoning_elem.text:
-            result["reasoning"] = reasoning_elem.text.strip()
-        
-        # Extract bottlenecks
-        bottlenecks_elem = root.find("bottlenecks")
-        if bottlenecks_elem is not None:
-            for bottleneck_elem in bottlenecks_elem.findall("bottleneck"):
-                bottleneck_type = bottleneck_elem.get("type", "Unknown")
-                bottleneck_severity = bottleneck_elem.get("severity", "Medium")
-                bottleneck_text = bottleneck_elem.text.strip() if bottleneck_elem.text else ""
-                result["bottlenecks"].append({
-                    "type": bottleneck_type,
-                    "severity": bottleneck_severity,
-                    "description": bottleneck_text
-                })
-        
-        # Extract root causes
-        root_causes_elem = root.find("root_causes")
-        if root_causes_elem is not None:
-            for cause_elem in root_causes_elem.findall("root_cause"):
-                cause_type = cause_elem.get("type", "Unknown")
-                cause_text = cause_elem.text.strip() if cause_elem.text else ""
-                result["root_causes"].append({
-                    "type": cause_type,
-                    "description": cause_text
-                })
-        
-        # Extract recommendations
-        recommendations_elem = root.find("recommendations")
-        if recommendations_elem is not None:
-            for rec_elem in recommendations_elem.findall("recommendation"):
-                rec_type = rec_elem.get("type", "Unknown")
-                rec_priority = rec_elem.get("priority", "Medium")
-                rec_text = rec_elem.text.strip() if rec_elem.text else ""
-                result["recommendations"].append({
-                    "type": rec_type,
-                    "priority": rec_priority,
-                    "description": rec_text
-                })
-        
-        # Extract comments
-        comments_elem = root.find("comments")
-        if comments_elem is not None:
-            for comment_elem in comments_elem.findall("comment"):
-                comment_text = comment_elem.text.strip() if comment_elem.text else ""
+        # Stream the section in a single pass; each item is cleared once read
+        source = io.BytesIO(diagnosis_xml.encode("utf-8"))
+        root_closed = False
+        for _, elem in ET.iterparse(source, events=("end",), **_ITERPARSE_OPTIONS):
+            tag = elem.tag
+            spec = _DIAGNOSIS_ITEM_FIELDS.get(tag)
+            if spec is not None:
+                key, attrs = spec
+                get = elem.get
+                item = {name: get(name, default) for name, default in attrs}
+                item["description"] = _elem_text(elem)
+                result[key].append(item)
+            elif tag == "reasoning":
+                if not result["reasoning"]:
+                    result["reasoning"] = _elem_text(elem)
+            elif tag == "comment":
+                comment_text = _elem_text(elem)
                 if comment_text:
                     result["comments"].append(comment_text)
+            elif tag == "diagnosis":
+                root_closed = True
+                continue
+            else:
+                continue
+            elem.clear()
+    
+    except _XML_PARSE_ERRORS as e:
+        _apply_reasoning_fallback(result, xml_response, str(e))
+        return result
     
-    except Exception as e:
-        # Fallback: try to extract reasoning text manually
-        reasoning_start = xml_response.find("<reasoning>")
-        reasoning_end = xml_response.find("</reasoning>")
+    if not root_closed:
+        # Parsed without an error but never produced the <diagnosis> element itself
+        _apply_reasoning_fallback(result, xml_response, "Could not parse <diagnosis> XML")
+    
+    return result
+
+
+def _apply_reasoning_fallback(result: Dict[str, any], xml_response: str, error: str) -> None:
+    """Fill ``result`` from an unparseable response: raw reasoning text plus the error."""
+    # Fallback: try to extract reasoning text manually
+    reasoning_match = _REASONING_BLOCK_RE.search(xml_response)
+    
+    if reasoning_match is not None:
+        reasoning_text = reasoning_match.group(1).strip()
         
-        if reasoning_start != -1 and reasoning_end != -1:
-            reasoning_start += len("<reasoning>")
-            reasoning_text = xml_response[reasoning_start:reasoning_end].strip()
-            
-            # Remove CDATA wrapper if present
-            if reasoning_text.startswith("<![CDATA[") and reasoning_text.endswith("]]>"):
-                reasoning_text = reasoning_text[9:-3].strip()
-            
-            result["reasoning"] = reasoning_text
+        # Remove CDATA wrapper if present
+        if reasoning_text.startswith("<![CDATA[") and reasoning_text.endswith("]]>"):
+            reasoning_text = reasoning_text[9:-3].strip()
         
-        result["parse_error"] = str(e)
-        result["raw_response"] = xml_response
+        result["reasoning"] = reasoning_text
     
-    return result
+    result["parse_error"] = error
+    result["raw_response"] = xml_response
 
 
 def format_diagnosis_output(diagnosis: Dict[str, any]) -> str:
@@ -164,63 +196,57 @@ def format_diagnosis_output(diagnosis: Dict[str, any]) -> str:
         Formatted text string (with XML tags hidden from end users)
     """
     
-    output = []
-    output.append("=" * 80)
-    output.append("DATABASE PERFORMANCE DIAGNOSIS")
-    output.append("=" * 80)
-    output.append("")
+    buf = io.StringIO()
+    w = buf.write
+    w(_REPORT_HEADER)
     
     # Reasoning section
     if diagnosis.get("reasoning"):
-        output.append("🔍 ANALYSIS & REASONING")
-        output.append("-" * 40)
-        output.append(diagnosis["reasoning"])
-        output.append("")
+        w("🔍 ANALYSIS & REASONING\n" + _SECTION_RULE)
+        w(diagnosis["reasoning"])
+        w("\n\n")
     
     # Bottlenecks section
     if diagnosis.get("bottlenecks"):
-        output.append("🚨 PERFORMANCE BOTTLENECKS")
-        output.append("-" * 40)
-        for i, bottleneck in enumerate(diagnosis["bottlenecks"], 1):
-            severity = bottleneck.get('severity', 'Medium')
-            severity_icon = {"High": "🔴", "Medium": "🟠", "Low": "🟡"}.get(severity, "🟠")
-            output.append(f"{i}. {severity_icon} {bottleneck['type']} ({severity}): {bottleneck['description']}")
-        output.append("")
+        w("🚨 PERFORMANCE BOTTLENECKS\n" + _SECTION_RULE)
+        w("\n".join(
+            f"{i}. {_SEVERITY_ICONS.get(b.get('severity', 'Medium'), '🟠')} {b['type']} ({b.get('severity', 'Medium')}): {b['description']}"
+            for i, b in enumerate(diagnosis["bottlenecks"], 1)
+        ))
+        w("\n\n")
     
     # Root causes section
     if diagnosis.get("root_causes"):
-        output.append("⚠️  ROOT CAUSES IDENTIFIED")
-        output.append("-" * 40)
-        for i, cause in enumerate(diagnosis["root_causes"], 1):
-            output.append(f"{i}. {cause['type']}: {cause['description']}")
-        output.append("")
+        w("⚠️  ROOT CAUSES IDENTIFIED\n" + _SECTION_RULE)
+        w("\n".join(
+            f"{i}. {cause['type']}: {cause['description']}"
+            for i, cause in enumerate(diagnosis["root_causes"], 1)
+        ))
+        w("\n\n")
     
     # Recommendations section
     if diagnosis.get("recommendations"):
-        output.append("💡 RECOMMENDATIONS")
-        output.append("-" * 40)
-        for i, rec in enumerate(diagnosis["recommendations"], 1):
-            output.append(f"{i}. {rec['type']}: {rec['description']}")
-        output.append("")
+        w("💡 RECOMMENDATIONS\n" + _SECTION_RULE)
+        w("\n".join(
+            f"{i}. {rec['type']}: {rec['description']}"
+            for i, rec in enumerate(diagnosis["recommendations"], 1)
+        ))
+        w("\n\n")
     
     # Comments section
     if diagnosis.get("comments"):
-        output.append("📝 ADDITIONAL COMMENTS")
-        output.append("-" * 40)
-        for comment in diagnosis["comments"]:
-            output.append(f"• {comment}")
-        output.append("")
+        w("📝 ADDITIONAL COMMENTS\n" + _SECTION_RULE)
+        w("\n".join(f"• {comment}" for comment in diagnosis["comments"]))
+        w("\n\n")
     
     # Only show error information in debug mode, not to end users
     if diagnosis.get("parse_error"):
-        output.append("⚠️  ANALYSIS COMPLETED")
-        output.append("-" * 40)
-        output.append("Note: Analysis completed with extracted information above.")
-        output.append("")
+        w("⚠️  ANALYSIS COMPLETED\n" + _SECTION_RULE)
+        w("Note: Analysis completed with extracted information above.\n\n")
     
-    output.append("=" * 80)
+    w(_REPORT_RULE)
     
-    return "\n".join(output)
+    return buf.getvalue()
 
 
 def clean_response_from_xml_tags(response_text: str) -> str:
@@ -233,38 +259,19 @@ def clean_response_from_xml_tags(response_text: str) -> str:
     Returns:
         Cleaned text with XML tags removed
     """
-    import re
     
-    # Remove common XML tags that might leak through
-    xml_patterns = [
-        r'</?analysis[^>]*>',
-        r'</?diagnosis[^>]*>',
-        r'</?reasoning[^>]*>',
-        r'</?bottlenecks?[^>]*>',
-        r'</?root_causes?[^>]*>',
-        r'</?recommendations?[^>]*>',
-        r'</?comments?[^>]*>',
-        r'</?tips?[^>]*>',
-        r'</?queries?[^>]*>',
-        r'</?response[^>]*>',
-        r'<!\[CDATA\[',
-        r'\]\]>',
-    ]
-    
-    cleaned_text = response_text
-    for pattern in xml_patterns:
-        cleaned_text = re.sub(pattern, '', cleaned_text, flags=re.IGNORECASE)
-    
-    # Clean up any remaining angle brackets that look like broken XML
-    cleaned_text = re.sub(r'<[^>]*>', '', cleaned_text)
+    # Remove the known tags first, then any remaining angle-bracket tags
+    cleaned_text = _KNOWN_TAG_CLEANUP_RE.sub('', response_text)
+    cleaned_text = _GENERIC_TAG_CLEANUP_RE.sub('', cleaned_text)
     
     # Clean up extra whitespace
-    cleaned_text = re.sub(r'\n\s*\n\s*\n', '\n\n', cleaned_text)
+    cleaned_text = _BLANK_LINES_RE.sub('\n\n', cleaned_text)
     cleaned_text = cleaned_text.strip()
     
     return cleaned_text
 
 
+@lru_cache(maxsize=1)
 def create_system_prompt() -> str:
     """
     Create the system prompt that instructs the LLM on XML format.
@@ -323,6 +330,7 @@ Common recommendation types: CreateIndex, RewriteQuery, UpdateStatistics, Config
 Always provide reasoning first, then identify bottlenecks with severity, then root causes, then prioritized recommendations."""
 
 
+@lru_cache(maxsize=1)
 def create_chat_system_prompt() -> str:
     """
     Create the simplified chat system prompt for the SQL master assistant.
@@ -385,3 +393,47 @@ def extract_response_from_text(raw_text: str) -> str:
         pass
     # Fallback to cleaning tags
     return clean_response_from_xml_tags(raw_text)
+
+
+def extract_response_from_stream(chunks: Iterable[str]) -> Iterator[str]:
+    """
+    Streaming counterpart of extract_response_from_text.
+    Yields content inside <response>...</response> as chunks arrive, holding
+    back trailing whitespace and enough text to recognise a closing tag split
+    across chunks, so the joined output matches the stripped text.
+    Falls back to cleaning XML-like tags once the stream ends if no
+    <response> tag was seen.
+    """
+    open_tag, close_tag = "<response>", "</response>"
+    buffer = ""
+    started = emitted = False
+    for chunk in chunks:
+        buffer += chunk or ""
+        if not started:
+            start = buffer.find(open_tag)
+            if start == -1:
+                continue
+            buffer = buffer[start + len(open_tag):]
+            started = True
+        if not emitted:
+            buffer = buffer.lstrip()
+        end = buffer.find(close_tag)
+        if end != -1:
+            tail = buffer[:end].rstrip()
+            if tail:
+                yield tail
+            return
+        # Keep a possible partial closing tag, and any whitespace before it, for the next chunk
+        safe = len(buffer) - (len(close_tag) - 1)
+        if safe > 0:
+            text = buffer[:safe].rstrip()
+            if text:
+                yield text
+                buffer = buffer[len(text):]
+                emitted = True
+    if started:
+        tail = buffer.rstrip()
+        if tail:
+            yield tail
+    else:
+        yield clean_response_from_xml_tags(buffer)